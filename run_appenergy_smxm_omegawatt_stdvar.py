@@ -9,7 +9,7 @@
 
 import subprocess
 import time
-import pandas as pd
+import numpy as np
 import os
 import argparse
 from pathlib import Path
@@ -17,9 +17,46 @@ import signal
 import sys
 from datetime import datetime, timedelta
 import json
+import csv
+import tempfile
+from dataclasses import dataclass
 
-def measure_baseline():
-    """Measure baseline power using existing script"""
+@dataclass(slots=True)
+class PowerStats:
+    """Total and per-plug power statistics of one application run"""
+    mean: float
+    min: float
+    max: float
+    std: float
+    var: float
+    power1_mean: float
+    power1_std: float
+    power1_var: float
+    power5_mean: float
+    power5_std: float
+    power5_var: float
+
+def load_cached_baseline(baseline_ttl):
+    """Return the baseline power from baseline.json if it is younger than baseline_ttl seconds"""
+    if not os.path.exists("baseline.json"):
+        return None
+    try:
+        with open("baseline.json", 'r') as f:
+            data = json.load(f)
+        if time.time() - data['timestamp'] < baseline_ttl:
+            return data['avg_power']
+    except Exception as e:
+        print(f"Ignoring unreadable baseline cache: {e}")
+    return None
+
+def measure_baseline(force_baseline=False, baseline_ttl=1800):
+    """Measure baseline power using existing script, reusing a recent cached result"""
+    if not force_baseline:
+        baseline_power = load_cached_baseline(baseline_ttl)
+        if baseline_power is not None:
+            print(f"\nUsing cached baseline power: {baseline_power:.2f} W")
+            return baseline_power
+    
     print("\nMeasuring Baseline Power Consumption...")
     print("=======================================")
     
@@ -32,13 +69,9 @@ def measure_baseline():
     
     try:
         subprocess.run(cmd, check=True)
-        # Read the baseline power from the correct file name
-        with open("all_powerresults_omegawatt_varstd.txt", 'r') as f:
-            baseline_data = f.read()
-            for line in baseline_data.split('\n'):
-                if "Average Power Consumption" in line:
-                    baseline_power = float(line.split()[8])  # Adjusted index to match new format
-                    break
+        # Read the baseline power written by the baseline script
+        with open("baseline.json", 'r') as f:
+            baseline_power = json.load(f)['avg_power']
         print(f"Baseline power measured: {baseline_power:.2f} W")
         return baseline_power
     except Exception as e:
@@ -46,7 +79,7 @@ def measure_baseline():
         return None
 
 def run_application(app_type, matrix_size, num_threads=None):
-    """Run the matrix multiplication application"""
+    """Run the matrix multiplication application and return its output, or None on failure (callers time the run)"""
     if app_type == 'serial':
         cmd = ["./run_smxm.sh"]
     else:  # parallel
@@ -55,64 +88,142 @@ def run_application(app_type, matrix_size, num_threads=None):
             os.environ['OMP_NUM_THREADS'] = str(num_threads)
     
     try:
-        start_time = time.time()
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = process.communicate()
-        end_time = time.time()
-        execution_time = end_time - start_time
-        
-        if process.returncode != 0:
-            print(f"Error running application: {stderr.decode()}")
-            return None, 0
-        
-        return stdout.decode(), execution_time
+        # Spawn without fork() so the parent's large heap is not COW-marked on every launch;
+        # output goes to temporary files, which cannot fill up and block the child like pipes
+        with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+            pid = os.posix_spawn(cmd[0], cmd, os.environ, file_actions=[
+                (os.POSIX_SPAWN_DUP2, out.fileno(), 1),
+                (os.POSIX_SPAWN_DUP2, err.fileno(), 2)
+            ])
+            _, status = os.waitpid(pid, 0)
+            
+            if os.waitstatus_to_exitcode(status) != 0:
+                err.seek(0)
+                print(f"Error running application: {err.read().decode()}")
+                return None
+            
+            out.seek(0)
+            return out.read().decode()
     except Exception as e:
         print(f"Error running application: {e}")
-        return None, 0
+        return None
+
+def mean_and_variance(values):
+    """Return the mean and sample variance of an array from its sum and sum of squares"""
+    n = values.size
+    total = values.sum()
+    total_sq = np.dot(values, values)
+    mean = total / n
+    var = (total_sq - total * total / n) / (n - 1)
+    return mean, var
+
+def read_power_samples(csv_file):
+    """Read the timestamp and plug 1/5 active power columns of a monitor CSV into NumPy arrays"""
+    with open(csv_file, 'r') as f:
+        header = next(csv.reader(f))
+        # Skip malformed rows (e.g. the one truncated when the meter is killed mid-write),
+        # keeping only rows with as many fields as the header, like the baseline streamer
+        rows = [line for line in f if line.count(',') == len(header) - 1]
+    
+    columns = [header.index(name) for name in ('#timestamp', '#activepow1', '#activepow5')]
+    samples = np.loadtxt(rows, delimiter=',', usecols=columns, ndmin=2)
+    return samples[:, 0], samples[:, 1], samples[:, 2]
 
-def process_power_data(csv_file):
-    """Process power measurements from CSV file"""
+def process_power_data(csv_file, window=None):
+    """Process power measurements from CSV file, optionally only those inside a (start, end) timestamp window"""
     try:
-        df = pd.read_csv(csv_file)
-        power1 = df['#activepow1']
-        power5 = df['#activepow5']
+        timestamps, power1, power5 = read_power_samples(csv_file)
+        
+        # Keep only the samples taken while the application was running
+        # (timestamps are monotonically increasing, so the window is a contiguous slice)
+        if window is not None:
+            lo = np.searchsorted(timestamps, window[0], side='left')
+            hi = np.searchsorted(timestamps, window[1], side='right')
+            if hi - lo < 2:
+                raise ValueError("fewer than two samples inside the application window")
+            power1 = power1[lo:hi]
+            power5 = power5[lo:hi]
         total_power = power1 + power5
         
-        stats = {
-            'mean': total_power.mean(),
-            'min': total_power.min(),
-            'max': total_power.max(),
-            'std': total_power.std(),
-            'var': total_power.var(),
-            'power1_mean': power1.mean(),
-            'power1_std': power1.std(),
-            'power1_var': power1.var(),
-            'power5_mean': power5.mean(),
-            'power5_std': power5.std(),
-            'power5_var': power5.var()
-        }
+        mean1, var1 = mean_and_variance(power1)
+        mean5, var5 = mean_and_variance(power5)
+        mean, var = mean_and_variance(total_power)
+        
+        stats = PowerStats(
+            mean=mean,
+            min=total_power.min(),
+            max=total_power.max(),
+            std=np.sqrt(var),
+            var=var,
+            power1_mean=mean1,
+            power1_std=np.sqrt(var1),
+            power1_var=var1,
+            power5_mean=mean5,
+            power5_std=np.sqrt(var5),
+            power5_var=var5
+        )
         
         print(f"Plug 1 measurements:")
-        print(f"  Average power: {stats['power1_mean']:.2f} W")
-        print(f"  Standard deviation: {stats['power1_std']:.2f} W")
-        print(f"  Variance: {stats['power1_var']:.2f} W²")
+        print(f"  Average power: {stats.power1_mean:.2f} W")
+        print(f"  Standard deviation: {stats.power1_std:.2f} W")
+        print(f"  Variance: {stats.power1_var:.2f} W²")
         
         print(f"\nPlug 5 measurements:")
-        print(f"  Average power: {stats['power5_mean']:.2f} W")
-        print(f"  Standard deviation: {stats['power5_std']:.2f} W")
-        print(f"  Variance: {stats['power5_var']:.2f} W²")
+        print(f"  Average power: {stats.power5_mean:.2f} W")
+        print(f"  Standard deviation: {stats.power5_std:.2f} W")
+        print(f"  Variance: {stats.power5_var:.2f} W²")
         
         print(f"\nTotal measurements:")
-        print(f"  Total average power: {stats['mean']:.2f} W")
-        print(f"  Total standard deviation: {stats['std']:.2f} W")
-        print(f"  Total variance: {stats['var']:.2f} W²")
+        print(f"  Total average power: {stats.mean:.2f} W")
+        print(f"  Total standard deviation: {stats.std:.2f} W")
+        print(f"  Total variance: {stats.var:.2f} W²")
         
         return stats
     except Exception as e:
         print(f"Error processing CSV data: {e}")
         return None
 
-def measure_app_power(app_type, matrix_size, num_threads=None):
+def start_power_monitor(csv_file):
+    """Start the Omegawatt meter writing its samples straight to csv_file"""
+    with open(csv_file, "wb") as f:
+        return subprocess.Popen([
+            "/home/uasgher/wattmeter-readinstall/wattmetre-read/v3/wattmetre-readnew2",
+            "--tty=/dev/ttyUSB0", "--nb=6"
+        ], stdout=f)
+
+def stop_power_monitor(monitor_process):
+    """Stop the Omegawatt meter with SIGINT, escalating to SIGTERM and SIGKILL if it does not exit promptly"""
+    monitor_process.send_signal(signal.SIGINT)
+    try:
+        monitor_process.wait(timeout=0.2)
+    except subprocess.TimeoutExpired:
+        monitor_process.terminate()
+        try:
+            monitor_process.wait(timeout=0.5)
+        except subprocess.TimeoutExpired:
+            monitor_process.kill()
+            monitor_process.wait()
+
+def wait_for_first_sample(csv_file, monitor_process, timeout=5):
+    """Block until the monitor has written its CSV header and at least one sample row"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and monitor_process.poll() is None:
+        with open(csv_file, 'rb') as f:
+            if f.read(4096).count(b'\n') >= 2:
+                return True
+        time.sleep(0.01)
+    return False
+
+def wait_for_more_samples(csv_file, size, monitor_process, timeout=1):
+    """Block until the monitor has appended data beyond size bytes to its CSV file"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and monitor_process.poll() is None:
+        if os.path.getsize(csv_file) > size:
+            return True
+        time.sleep(0.01)
+    return False
+
+def measure_app_power(app_type, matrix_size, num_threads=None, force_baseline=False, baseline_ttl=1800):
     """Measure power while running the application"""
     output_dir = "."
     results_file = os.path.join(output_dir, f"power_{app_type}_mxm.txt")
@@ -122,7 +233,7 @@ def measure_app_power(app_type, matrix_size, num_threads=None):
         os.remove(results_file)
     
     # First get baseline power
-    baseline_power = measure_baseline()
+    baseline_power = measure_baseline(force_baseline, baseline_ttl)
     if baseline_power is None:
         return
     
@@ -130,38 +241,39 @@ def measure_app_power(app_type, matrix_size, num_threads=None):
     print("=============================")
     
     # Start continuous power monitoring
-    monitor_process = subprocess.Popen([
-        "/home/uasgher/wattmeter-readinstall/wattmetre-read/v3/wattmetre-readnew2",
-        "--tty=/dev/ttyUSB0", "--nb=6"
-    ], stdout=open("mxm_power.csv", "w"))
+    monitor_process = start_power_monitor("mxm_power.csv")
     
-    time.sleep(1)  # Wait for monitoring to start
+    # Wait for monitoring to start
+    if not wait_for_first_sample("mxm_power.csv", monitor_process):
+        print("Power monitor did not produce any samples")
+        stop_power_monitor(monitor_process)
+        return
     
     # Run the application
     print(f"\nRunning {app_type} matrix multiplication...")
-    output, execution_time = run_application(app_type, matrix_size, num_threads)
+    # The meter stamps samples with the Unix time, so the window uses the same clock
+    app_start = time.time()
+    output = run_application(app_type, matrix_size, num_threads)
+    app_end = time.time()
     if output is None:
-        monitor_process.terminate()
+        stop_power_monitor(monitor_process)
         return
+    execution_time = app_end - app_start
     
-    time.sleep(1)  # Wait for final measurements
+    # Wait for the samples covering the end of the run
+    wait_for_more_samples("mxm_power.csv", os.path.getsize("mxm_power.csv"), monitor_process)
     
     # Stop monitoring
-    monitor_process.terminate()
-    try:
-        monitor_process.wait(timeout=1)
-    except subprocess.TimeoutExpired:
-        monitor_process.kill()
-        monitor_process.wait()
+    stop_power_monitor(monitor_process)
     
     # Process the power data
-    execution_stats = process_power_data("mxm_power.csv")
+    execution_stats = process_power_data("mxm_power.csv", (app_start, app_end))
     if execution_stats is None:
         print("Failed to process power data")
         return
     
     # Calculate power and energy
-    execution_power = execution_stats['mean']
+    execution_power = execution_stats.mean
     power_increase = execution_power - baseline_power
     
     # Calculate energies
@@ -175,34 +287,37 @@ def measure_app_power(app_type, matrix_size, num_threads=None):
     dynamic_energy_wh = dynamic_energy_joules / 3600
     
     # Save results
-    with open(results_file, 'w') as f:
-        f.write(f"MATRIX MULTIPLICATION ENERGY REPORT ({app_type})\n")
-        f.write("=========================================\n\n")
+    report = [
+        f"MATRIX MULTIPLICATION ENERGY REPORT ({app_type})\n",
+        "=========================================\n\n",
         
-        f.write("1. Baseline Measurements\n")
-        f.write("----------------------\n")
-        f.write(f"Baseline Power: {baseline_power:.2f} W\n\n")
+        "1. Baseline Measurements\n",
+        "----------------------\n",
+        f"Baseline Power: {baseline_power:.2f} W\n\n",
         
-        f.write("2. Application Measurements\n")
-        f.write("-------------------------\n")
-        f.write(f"Total Power during execution: {execution_power:.2f} W\n")
-        f.write(f"Dynamic Power (increase): {power_increase:.2f} W\n")
-        f.write(f"Peak Power: {execution_stats['max']:.2f} W\n")
-        f.write(f"Standard Deviation: {execution_stats['std']:.2f} W\n")
-        f.write(f"Variance: {execution_stats['var']:.2f} W²\n")
-        f.write(f"Execution Time: {execution_time:.3f} seconds\n\n")
+        "2. Application Measurements\n",
+        "-------------------------\n",
+        f"Total Power during execution: {execution_power:.2f} W\n",
+        f"Dynamic Power (increase): {power_increase:.2f} W\n",
+        f"Peak Power: {execution_stats.max:.2f} W\n",
+        f"Standard Deviation: {execution_stats.std:.2f} W\n",
+        f"Variance: {execution_stats.var:.2f} W²\n",
+        f"Execution Time: {execution_time:.3f} seconds\n\n",
         
-        f.write("3. Energy Analysis\n")
-        f.write("----------------\n")
-        f.write(f"Baseline Energy: {baseline_energy_wh:.6f} Wh ({baseline_energy_joules:.2f} J)\n")
-        f.write(f"Total Energy: {total_energy_wh:.6f} Wh ({total_energy_joules:.2f} J)\n")
-        f.write(f"Dynamic Energy: {dynamic_energy_wh:.6f} Wh ({dynamic_energy_joules:.2f} J)\n\n")
+        "3. Energy Analysis\n",
+        "----------------\n",
+        f"Baseline Energy: {baseline_energy_wh:.6f} Wh ({baseline_energy_joules:.2f} J)\n",
+        f"Total Energy: {total_energy_wh:.6f} Wh ({total_energy_joules:.2f} J)\n",
+        f"Dynamic Energy: {dynamic_energy_wh:.6f} Wh ({dynamic_energy_joules:.2f} J)\n\n",
         
-        f.write("4. Application Details\n")
-        f.write("--------------------\n")
-        f.write(f"Application Type: {app_type}\n")
-        if num_threads:
-            f.write(f"Number of Threads: {num_threads}\n")
+        "4. Application Details\n",
+        "--------------------\n",
+        f"Application Type: {app_type}\n"
+    ]
+    if num_threads:
+        report.append(f"Number of Threads: {num_threads}\n")
+    with open(results_file, 'w') as f:
+        f.write("".join(report))
     
     print(f"\nResults have been saved to: {results_file}")
     
@@ -216,22 +331,138 @@ def measure_app_power(app_type, matrix_size, num_threads=None):
     print(f"   Execution Time: {execution_time:.3f} seconds")
     print(f"   Total Power: {execution_power:.2f} W")
     print(f"   Dynamic Power (increase): {power_increase:.2f} W")
-    print(f"   Standard Deviation: {execution_stats['std']:.2f} W")
-    print(f"   Variance: {execution_stats['var']:.2f} W²")
+    print(f"   Standard Deviation: {execution_stats.std:.2f} W")
+    print(f"   Variance: {execution_stats.var:.2f} W²")
     
     print(f"\n3. Energy Breakdown:")
     print(f"   Baseline Energy: {baseline_energy_wh:.6f} Wh ({baseline_energy_joules:.2f} J)")
     print(f"   Total Energy: {total_energy_wh:.6f} Wh ({total_energy_joules:.2f} J)")
     print(f"   Dynamic Energy: {dynamic_energy_wh:.6f} Wh ({dynamic_energy_joules:.2f} J)")
 
+def interval_stats(timestamps, total_power, intervals):
+    """Compute mean/std/var/peak of total power for each (label, start, end) interval of one capture"""
+    # Timestamps are monotonically increasing, so each interval is a contiguous slice
+    starts = np.array([start for _, start, _ in intervals])
+    ends = np.array([end for _, _, end in intervals])
+    lo = np.searchsorted(timestamps, starts, side='left')
+    hi = np.searchsorted(timestamps, ends, side='right')
+    
+    # Prefix sums give every interval's sum and sum of squares in one pass
+    cum_power = np.concatenate(([0.0], np.cumsum(total_power)))
+    cum_sq_power = np.concatenate(([0.0], np.cumsum(total_power * total_power)))
+    n = hi - lo
+    sums = cum_power[hi] - cum_power[lo]
+    sums_sq = cum_sq_power[hi] - cum_sq_power[lo]
+    
+    results = []
+    for (label, start, end), count, total, total_sq, i, j in zip(intervals, n, sums, sums_sq, lo, hi):
+        if count < 2:
+            print(f"Skipping {label}: fewer than two samples in its interval")
+            continue
+        var = (total_sq - total * total / count) / (count - 1)
+        results.append({
+            'label': label,
+            'duration': end - start,
+            'mean': total / count,
+            'max': total_power[i:j].max(),
+            'std': np.sqrt(var),
+            'var': var
+        })
+    return results
+
+def run_sweep(thread_counts, idle_time=10):
+    """Measure serial and parallel runs under a single power capture and slice it per run"""
+    csv_file = "sweep.csv"
+    results_file = "power_sweep_mxm.txt"
+    
+    if os.path.exists(results_file):
+        os.remove(results_file)
+    
+    print("\nMeasuring Sweep Power...")
+    print("=======================")
+    
+    monitor_process = start_power_monitor(csv_file)
+    if not wait_for_first_sample(csv_file, monitor_process):
+        print("Power monitor did not produce any samples")
+        stop_power_monitor(monitor_process)
+        return
+    
+    # The first segment of the capture is idle and serves as the baseline
+    print(f"\nRecording {idle_time} s of idle baseline...")
+    idle_start = time.time()
+    time.sleep(idle_time)
+    intervals = [('idle', idle_start, time.time())]
+    
+    configs = [('serial', None)] + [('parallel', threads) for threads in thread_counts]
+    for app_type, num_threads in configs:
+        label = app_type if num_threads is None else f"{app_type} ({num_threads} threads)"
+        print(f"\nRunning {label} matrix multiplication...")
+        app_start = time.time()
+        output = run_application(app_type, None, num_threads)
+        app_end = time.time()
+        if output is None:
+            continue
+        intervals.append((label, app_start, app_end))
+    
+    wait_for_more_samples(csv_file, os.path.getsize(csv_file), monitor_process)
+    stop_power_monitor(monitor_process)
+    
+    # Post-process the whole capture once
+    try:
+        timestamps, power1, power5 = read_power_samples(csv_file)
+        results = interval_stats(timestamps, power1 + power5, intervals)
+    except Exception as e:
+        print(f"Error processing sweep data: {e}")
+        return
+    if not results or results[0]['label'] != 'idle':
+        print("Failed to measure the idle baseline")
+        return
+    
+    baseline_power = results[0]['mean']
+    
+    report = [
+        "MATRIX MULTIPLICATION ENERGY SWEEP REPORT\n",
+        "=========================================\n\n",
+        f"Baseline Power (idle segment): {baseline_power:.2f} W\n"
+    ]
+    
+    for result in results[1:]:
+        power_increase = result['mean'] - baseline_power
+        total_energy_joules = result['mean'] * result['duration']
+        dynamic_energy_joules = power_increase * result['duration']
+        
+        report += [
+            f"\n{result['label']}\n",
+            "-" * len(result['label']) + "\n",
+            f"Execution Time: {result['duration']:.3f} seconds\n",
+            f"Total Power during execution: {result['mean']:.2f} W\n",
+            f"Dynamic Power (increase): {power_increase:.2f} W\n",
+            f"Peak Power: {result['max']:.2f} W\n",
+            f"Standard Deviation: {result['std']:.2f} W\n",
+            f"Variance: {result['var']:.2f} W²\n",
+            f"Total Energy: {total_energy_joules / 3600:.6f} Wh ({total_energy_joules:.2f} J)\n",
+            f"Dynamic Energy: {dynamic_energy_joules / 3600:.6f} Wh ({dynamic_energy_joules:.2f} J)\n"
+        ]
+        
+        print(f"\n{result['label']}:")
+        print(f"   Execution Time: {result['duration']:.3f} seconds")
+        print(f"   Total Power: {result['mean']:.2f} W")
+        print(f"   Dynamic Power (increase): {power_increase:.2f} W")
+        print(f"   Dynamic Energy: {dynamic_energy_joules:.2f} J")
+    
+    with open(results_file, 'w') as f:
+        f.write("".join(report))
+    
+    print(f"\nResults have been saved to: {results_file}")
+
 def cleanup_previous_outputs():
     """Remove all previous output files before starting new measurements"""
     files_to_remove = [
-        "all_powerresults_omegawatt_varstd.txt",
-        "Omegawatt-output.csv",
         "mxm_power.csv",
         "power_serial_mxm.txt",
-        "power_parallel_mxm.txt"
+        "power_parallel_mxm.txt",
+        "sweep.csv",
+        "power_sweep_mxm.txt"
     ]
     
     print("Cleaning up previous output files...")
@@ -250,13 +481,24 @@ def main():
                       help='Type of application to run (default: serial)')
     parser.add_argument('--threads', type=int,
                       help='Number of threads (for parallel version)')
+    parser.add_argument('--force-baseline', action='store_true',
+                      help='Re-measure the baseline even if a recent baseline.json exists')
+    parser.add_argument('--baseline-ttl', type=int, default=1800,
+                      help='Seconds a cached baseline.json stays valid (default: 1800)')
+    parser.add_argument('--sweep-threads', type=int, nargs='+',
+                      help='Run serial plus parallel with each of these thread counts under one power capture')
+    parser.add_argument('--idle-time', type=int, default=10,
+                      help='Seconds of idle baseline recorded at the start of a sweep (default: 10)')
     
     args = parser.parse_args()
     
     # Clean up previous output files
     cleanup_previous_outputs()
     
-    measure_app_power(args.app_type, None, args.threads)
+    if args.sweep_threads:
+        run_sweep(args.sweep_threads, args.idle_time)
+    else:
+        measure_app_power(args.app_type, None, args.threads, args.force_baseline, args.baseline_ttl)
 
 if __name__ == "__main__":
     main()
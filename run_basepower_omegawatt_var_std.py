@@ -8,80 +8,143 @@
 
 import subprocess
 import time
-import pandas as pd
 import os
 import argparse
 from pathlib import Path
 import signal
 import sys
+import json
+import math
+import threading
+from array import array
+from dataclasses import dataclass
+import numpy as np
 
-def run_wattmeter(output_dir, measurement_time=5):
-    """Run the wattmeter executable and save output to CSV"""
+try:
+    from numba import njit
+except ImportError:
+    # Numba is optional; without it fold_samples runs as plain Python
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+@dataclass(slots=True)
+class PowerStats:
+    """Power statistics of one measurement iteration"""
+    total_avg_power: float
+    energy_wh: float
+    energy_joules: float
+    std_dev: float
+    variance: float
+    num_samples: int
+    sum_power: float
+    sum_sq_power: float
+
+@njit(cache=True, fastmath=True)
+def fold_samples(buf):
+    """Reduce an (n, 3) array of timestamp/plug 1/plug 5 rows to per-plug and total sums"""
+    n = buf.shape[0]
+    s1 = ss1 = s5 = ss5 = s = ss = 0.0
+    for k in range(n):
+        p1 = buf[k, 1]
+        p5 = buf[k, 2]
+        total = p1 + p5
+        s1 += p1
+        ss1 += p1 * p1
+        s5 += p5
+        ss5 += p5 * p5
+        s += total
+        ss += total * total
+    
+    # The meter emits monotonically increasing timestamps, so the first and last
+    # rows bound the capture without a min/max scan
+    first_ts = buf[0, 0] if n > 0 else math.inf
+    last_ts = buf[n - 1, 0] if n > 0 else -math.inf
+    return n, s1, ss1, s5, ss5, s, ss, first_ts, last_ts
+
+def stop_power_monitor(monitor_process):
+    """Stop the Omegawatt meter with SIGINT, escalating to SIGTERM and SIGKILL if it does not exit promptly"""
+    monitor_process.send_signal(signal.SIGINT)
+    try:
+        monitor_process.wait(timeout=0.2)
+    except subprocess.TimeoutExpired:
+        monitor_process.terminate()
+        try:
+            monitor_process.wait(timeout=0.5)
+        except subprocess.TimeoutExpired:
+            monitor_process.kill()
+            monitor_process.wait()
+
+def run_wattmeter(measurement_time=5):
+    """Run the wattmeter executable and fold its samples into running sums"""
     meter_cmd = ["/home/uasgher/wattmeter-readinstall/wattmetre-read/v3/wattmetre-readnew2",
                  "--tty=/dev/ttyUSB0", "--nb=6"]
     
-    # Create output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
-    
-    output_file = os.path.join(output_dir, "Omegawatt-output.csv")
-    
+    process = None
+    timer = None
     try:
-        # Start the meter process
-        process = subprocess.Popen(meter_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        # Start the meter process; its output is parsed as bytes, without a text decoding layer
+        process = subprocess.Popen(meter_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
         
-        # Collect output for measurement_time seconds
-        start_time = time.time()
-        output_lines = []
+        # Locate the columns of interest from the CSV header
+        header = process.stdout.readline().strip().split(b',')
+        i_ts = header.index(b'#timestamp')
+        i1 = header.index(b'#activepow1')
+        i5 = header.index(b'#activepow5')
         
-        while time.time() - start_time < measurement_time:
-            line = process.stdout.readline()
-            if line:
-                output_lines.append(line)
+        # Buffer samples until the timer stops the meter after measurement_time seconds
+        buf = array('d')
+        timer = threading.Timer(measurement_time, stop_power_monitor, args=(process,))
+        timer.start()
+        for line in process.stdout:
+            fields = line.split(b',')
+            if len(fields) == len(header):
+                buf.extend((float(fields[i_ts]), float(fields[i1]), float(fields[i5])))
         
-        # Terminate the process
-        process.terminate()
-        try:
-            process.wait(timeout=1)
-        except subprocess.TimeoutExpired:
-            process.kill()
-            process.wait()
-        
-        # Save collected output to file
-        with open(output_file, 'w') as f:
-            f.writelines(output_lines)
+        # The meter has closed its output; reap it
+        process.wait()
         
-        return True
+        n, s1, ss1, s5, ss5, s, ss, first_ts, last_ts = fold_samples(
+            np.frombuffer(buf, dtype=np.float64).reshape(-1, 3))
+        return {
+            'n': n,
+            'sum_power1': s1, 'sum_sq_power1': ss1,
+            'sum_power5': s5, 'sum_sq_power5': ss5,
+            'sum_power': s, 'sum_sq_power': ss,
+            'first_timestamp': first_ts, 'last_timestamp': last_ts
+        }
     except Exception as e:
         print(f"Error running wattmeter: {e}")
-        return False
+        return None
+    finally:
+        # Never leave the meter holding the tty, whether it exited early or we failed mid-capture
+        if timer is not None:
+            timer.cancel()
+        if process is not None and process.poll() is None:
+            stop_power_monitor(process)
 
-def process_power_data(csv_file):
-    """Process the CSV file and calculate average power, variance, and standard deviation for columns 1 and 5"""
+def process_power_data(samples):
+    """Calculate average power, variance, and standard deviation for columns 1 and 5 from the accumulated samples"""
     try:
-        # Read CSV file
-        df = pd.read_csv(csv_file)
-        
-        # Get active power values for plugs 1 and 5
-        power1 = df['#activepow1']
-        power5 = df['#activepow5']
+        n = samples['n']
         
         # Calculate statistics
-        avg_power1 = power1.mean()
-        avg_power5 = power5.mean()
+        avg_power1 = samples['sum_power1'] / n
+        avg_power5 = samples['sum_power5'] / n
         total_avg_power = avg_power1 + avg_power5
         
         # Calculate variance and standard deviation
-        var_power1 = power1.var()
-        var_power5 = power5.var()
-        std_power1 = power1.std()
-        std_power5 = power5.std()
+        var_power1 = (samples['sum_sq_power1'] - samples['sum_power1'] * samples['sum_power1'] / n) / (n - 1)
+        var_power5 = (samples['sum_sq_power5'] - samples['sum_power5'] * samples['sum_power5'] / n) / (n - 1)
+        std_power1 = math.sqrt(var_power1)
+        std_power5 = math.sqrt(var_power5)
         
-        # Calculate total variance and std (assuming independence between plugs)
-        total_var_power = var_power1 + var_power5
-        total_std_power = (total_var_power) ** 0.5
+        # Calculate total variance and std of the per-sample total power (plug 1 + plug 5),
+        # the same definition used for the pooled result across iterations
+        total_var_power = (samples['sum_sq_power'] - samples['sum_power'] * samples['sum_power'] / n) / (n - 1)
+        total_std_power = math.sqrt(total_var_power)
         
         # Calculate energy consumption
-        measurement_duration = (df['#timestamp'].max() - df['#timestamp'].min()) / 3600  # Convert to hours
+        measurement_duration = (samples['last_timestamp'] - samples['first_timestamp']) / 3600  # Convert to hours
         energy_consumption_wh = total_avg_power * measurement_duration
         energy_consumption_joules = energy_consumption_wh * 3600  # Convert Wh to Joules
         
@@ -95,21 +158,19 @@ def process_power_data(csv_file):
         print(f"  Standard deviation: {std_power5:.2f} W")
         print(f"  Variance: {var_power5:.2f} W²")
         
-        return {
-            'total_avg_power': total_avg_power,
-            'energy_wh': energy_consumption_wh,
-            'energy_joules': energy_consumption_joules,
-            'std_dev': total_std_power,
-            'variance': total_var_power
-        }
+        return PowerStats(
+            total_avg_power=total_avg_power,
+            energy_wh=energy_consumption_wh,
+            energy_joules=energy_consumption_joules,
+            std_dev=total_std_power,
+            variance=total_var_power,
+            num_samples=n,
+            sum_power=samples['sum_power'],
+            sum_sq_power=samples['sum_sq_power']
+        )
     except Exception as e:
-        print(f"Error processing CSV file: {e}")
-        print("CSV contents:")
-        try:
-            with open(csv_file, 'r') as f:
-                print(f.read())
-        except Exception as read_error:
-            print(f"Could not read CSV file: {read_error}")
+        print(f"Error processing power samples: {e}")
+        print(f"Samples collected: {samples['n']}")
         return None
 
 def main():
@@ -125,16 +186,19 @@ def main():
     
     output_dir = "."
     results_file = os.path.join(output_dir, "all_powerresults_omegawatt_varstd.txt")
+    baseline_file = os.path.join(output_dir, "baseline.json")
     
     # Remove old power-out.txt file if it exists
     if os.path.exists(results_file):
         os.remove(results_file)
+    if os.path.exists(baseline_file):
+        os.remove(baseline_file)
     
-    total_power = 0
+    total_samples = 0
+    total_sum_power = 0
+    total_sum_sq_power = 0
     total_energy_wh = 0
     total_energy_joules = 0
-    total_std_dev = 0
-    total_variance = 0
     successful_runs = 0
     
     # Handle Ctrl+C gracefully
@@ -149,31 +213,32 @@ def main():
     for i in range(args.repetitions):
         print(f"\nIteration {i+1}/{args.repetitions}")
         
-        if run_wattmeter(output_dir, args.measurement_time):
-            csv_file = os.path.join(output_dir, "Omegawatt-output.csv")
-            result = process_power_data(csv_file)
+        samples = run_wattmeter(args.measurement_time)
+        if samples is not None:
+            result = process_power_data(samples)
             
             if result is not None:
-                total_power += result['total_avg_power']
-                total_energy_wh += result['energy_wh']
-                total_energy_joules += result['energy_joules']
-                total_std_dev += result['std_dev']
-                total_variance += result['variance']
+                total_samples += result.num_samples
+                total_sum_power += result.sum_power
+                total_sum_sq_power += result.sum_sq_power
+                total_energy_wh += result.energy_wh
+                total_energy_joules += result.energy_joules
                 successful_runs += 1
                 print(f"\nTotal measurements:")
-                print(f"  Total average power: {result['total_avg_power']:.2f} W")
-                print(f"  Total standard deviation: {result['std_dev']:.2f} W")
-                print(f"  Total variance: {result['variance']:.2f} W²")
-                print(f"  Energy consumption: {result['energy_wh']:.2f} Wh ({result['energy_joules']:.2f} J)")
+                print(f"  Total average power: {result.total_avg_power:.2f} W")
+                print(f"  Total standard deviation: {result.std_dev:.2f} W")
+                print(f"  Total variance: {result.variance:.2f} W²")
+                print(f"  Energy consumption: {result.energy_wh:.2f} Wh ({result.energy_joules:.2f} J)")
         
         if i < args.repetitions - 1:  # Don't sleep after the last iteration
             print(f"Sleeping for {args.sleep} seconds...")
             time.sleep(args.sleep)
     
-    if successful_runs > 0:
-        final_avg_power = total_power / successful_runs
-        final_std_dev = total_std_dev / successful_runs
-        final_variance = total_variance / successful_runs
+    if successful_runs > 0 and total_samples > 1:
+        # Pooled statistics over every sample from every iteration
+        final_avg_power = total_sum_power / total_samples
+        final_variance = (total_sum_sq_power - total_sum_power * total_sum_power / total_samples) / (total_samples - 1)
+        final_std_dev = math.sqrt(final_variance)
         # Calculate total energy from average power over total time
         total_time_seconds = args.repetitions * args.measurement_time
         total_energy_from_power = final_avg_power * total_time_seconds  # Energy in Joules
@@ -187,6 +252,15 @@ def main():
             f.write(f"Standard Deviation: {final_std_dev:.2f} W\n")
             f.write(f"Variance: {final_variance:.2f} W²\n")
         
+        # Save machine-readable baseline for run_appenergy_smxm_omegawatt_stdvar.py
+        with open(baseline_file, 'w') as f:
+            json.dump({
+                'avg_power': final_avg_power,
+                'std': final_std_dev,
+                'var': final_variance,
+                'timestamp': time.time()
+            }, f)
+        
         print(f"\nFinal Results:")
         print(f"Baseline/Average Power Consumption (Idle): {final_avg_power:.2f} W")
         print(f"Total Time: {total_time_seconds} seconds")